@@ -1,6 +1,11 @@
  # -*- coding: utf-8 -*-
+from itertools import product
+from time import perf_counter
+
+import bmesh
 import bpy
 import numpy as np
+from mathutils import Matrix
 
 bl_info = {
     'name': 'Springs generator',
@@ -15,6 +20,802 @@ bl_info = {
     'tracker_url': ''}
 
 
+# ########### SPRING GENERATION ##############
+
+def spring_dimensions(D, d, D2, H):
+    """Wire and hook diameters adjusted to the coil, number of active turns
+    and pitch (turns/unit of height) for an integer number of turns.
+    Lengths in meters, works on single springs or arrays of springs.
+    Returns d, D2, kn, p"""
+    # Adjust pitch for integer number of turns
+    kn = (H - 0.1*d)/(1.1*d)//1
+    p = kn/H
+
+    # decrease wire diam if outside diam or hook diam gets too small
+    d = np.where(3*d > D, D/2, d)
+    d = np.where(2*d > D2, D2/2, d)
+    # stop increasing hook diam if it gets too big
+    D2 = np.where(D2 > 1.5*D, 1.5*D, D2)
+    # stop decreasing hook diam if it gets too small
+    D2 = np.where(D2 < D/1.5, D/1.5, D2)
+    return d[()], D2[()], kn, p
+
+
+def spring_name(D, d, D2, H, h, hook_type=1):
+    """Name based upon the dimensions adjusted by spring_dimensions:
+    wire thickness x coil_outside_diam x hook_inside_diam x
+    distance_between_hook_centers"""
+    D = D+d
+    D2 = D2-d
+
+    name = ""
+    if (d*1000) % 1 > 0.1:
+        name += str(round(d*1000, 2))
+    else:
+        name += str(int(d*1000))
+
+    if (D*1000) % 1 > 0.1:
+        name += " x " + str(round(D*1000, 1))
+    else:
+        name += " x " + str(int(D*1000))
+
+    if hook_type == 1 or hook_type == 2:
+        if round(D2*1000, 3) % 1 > 0.01:
+            name += " x " + str(round(D2*1000, 1))
+        else:
+            name += " x " + str(int(round(D2*1000, 3)))
+
+    name_l = round(H*1000+D2*1000+h*1000*2+3*d*1000, 3)
+    if name_l % 1 > 0.01:
+        name += " x " + str(round(name_l, 1))
+    else:
+        name += " x " + str(int(name_l))
+    return name
+
+
+def remove_doubles(x, y, z):
+    """unique values for dots with euclidean distance less than
+    0.00001 which are esentially the same point"""
+    size = len(x)
+    xi = x[1:]-x[0:size-1]
+    yi = y[1:]-y[0:size-1]
+    zi = z[1:]-z[0:size-1]
+    dist = np.sqrt(np.power(xi, 2) + np.power(yi, 2) + np.power(zi, 2))
+    index = np.where(dist <= 0.00001)
+    x = np.delete(x, index)
+    y = np.delete(y, index)
+    z = np.delete(z, index)
+    print(f"Removed {size-len(x)} vertices...")
+    return x, y, z
+
+
+def find_angle(x, y):
+    angle = round(np.arctan(y/x), 2)
+    if x < 0 and y > 0:
+        angle += np.pi
+    elif x < 0 and y < 0:
+        angle += np.pi
+    elif x > 0 and y < -0.00001:
+        angle += 2*np.pi
+    return angle
+
+
+def coil_points(D, d, H, p, N, flat_ends=False):
+    """N points of a coil of diameter D and height H from top to bottom,
+    with the ends pulled in by the wire when they are ground flat"""
+    u = np.linspace(H, 0, N)
+    if flat_ends:
+        z = np.linspace(H-0.3*d/2,  0+0.3*d/2,  N)
+    else:
+        z = u
+    x = (D/2)*np.cos(2*np.pi*p*u)
+    y = (D/2)*np.sin(2*np.pi*p*u)
+    return x, y, z
+
+
+def spring_centerline(D, d, D2, H, h, p, N, hook_type=1, hook_angle=1,
+                      n=10):
+    """Points of the central line inside the coil of the spring, in 5 parts
+    from top to bottom:
+        5-upper hook
+        4-upper segment conecting hook and coil
+        1-coil
+        2-lower segment conecting hook and coil
+        3-lower hook
+    Each part is a tuple of x, y, z arrays, n is the number of hooks
+    longitudinal steps and N the number of coil points."""
+    #  coil coordinates
+    x1, y1, z1 = coil_points(D, d, H, p, N, hook_type == 3)
+    alpha = find_angle(x1[0], y1[0])
+
+    # angles for the "s" segments
+    if hook_type == 1 or hook_type == 2:
+        li = 7              # length ratio li:1
+        sleng = np.zeros(n + 1)   # segments lengths
+        rate = (li-1)/(n-1)
+        for i in range(n):
+            sleng[i] = 6 - i*rate
+        sleng = 1/2*np.pi*sleng/np.sum(sleng)
+
+        u = np.hstack([[2*np.pi],  np.zeros(n)])
+        for i in range(n):
+            u[i+1] = 2*np.pi - np.sum(sleng[0:i+1])
+    elif hook_type == 3:
+        last = (4*np.pi/5)*(0.5)/(d*p)
+        if last > 4/3*np.pi:
+            last = 4/3*np.pi
+        u = np.linspace(0, last, n)
+
+    # Lower s segment
+    if hook_type == 1:
+        x2 = D/2*abs(np.cos(u))
+        XG2 = D2/2*abs(np.cos(u))
+        y2 = D2/2*np.sin(u)
+        z2 = np.sqrt(abs((D2/2)**2-np.power(XG2,  2)))-D2/2
+        z2 = z2[-1::-1]
+    elif hook_type == 2:
+        x2 = (D/2-1.025*d)*abs(np.cos(u))+1.025*d
+        XG2 = D2/2*abs(np.cos(u))
+        y2 = D2/2*np.sin(u)
+        z2 = np.sqrt(abs((D2/2)**2-np.power(XG2,  2)))-D2/2
+        z2 = z2[-1::-1]
+    elif hook_type == 3:
+        x2 = D/2*np.cos(u)
+        y2 = -D/2*np.sin(u)
+        z2 = np.zeros(len(u))+0.3*d/2
+
+    # Upper s segment
+    if hook_type == 1:
+        u1 = u[-1::-1]
+        if hook_angle == 1:
+            x4 = D/2*(np.cos(u1+alpha))
+            XG4 = D2/2*(abs(np.cos(u1)))
+            y4 = D2/2*(-np.sin(u1+alpha))
+        elif hook_angle == 2:
+            x4 = D2/2*(-np.cos(u1+alpha))
+            XG4 = D2/2*(abs(np.cos(u1)))
+            y4 = (D/2)*(np.sin(u1+alpha))
+        z4 = -np.sqrt(abs((D2/2)**2-np.power(XG4, 2)))
+        z4 = (z4 + D2/2 + H)[-1::-1]
+
+    elif hook_type == 2:
+        u1 = u[-1::-1]
+        if hook_angle == 1:
+            x4 = (D/2-1.01*d)*abs(np.cos(u1))+1.01*d
+            XG4 = D2/2*(abs(np.cos(u1)))
+            y4 = D2/2*(- np.sin(u1))
+        elif hook_angle == 2:
+            x4 = -(D2/2)*np.cos(u1 + alpha)
+            XG4 = D2/2*(abs(np.cos(u1)))
+            y4 = (D/2-1.01*d)*(np.sin(u1 + alpha))+1.01*d
+        z4 = -np.sqrt(abs((D2/2)**2-np.power(XG4, 2)))
+        z4 = (z4 + D2/2 + H)[-1::-1]
+    elif hook_type == 3:
+        u1 = u + alpha
+        x4 = D/2*np.cos(u1[-1::-1])
+        y4 = D/2*np.sin(u1[-1::-1])
+        z4 = np.full(len(u), H)-0.3*d/2
+
+    # lower circular segment
+    if hook_type == 1:
+        u1 = np.linspace(np.pi, 2*np.pi, n)
+        y3 = D2/2*np.cos(u1)
+        z3 = D2/2*np.sin(u1)-D2/2-h-d
+        x3 = D/2*np.zeros(len(u1))
+
+    elif hook_type == 2:
+        u1 = np.linspace(4*np.pi, 0, 4*n)
+        x3 = ((u1-2*np.pi)/(4*np.pi)*2.05*d)
+        y3 = -D2/2*np.cos(u1)
+        z3 = D2/2*(-np.sin(u1)-1)[-1::-1]
+    elif hook_type == 3:
+        x3, y3, z3 = ([], [], [])
+
+    # Upper circular segment
+    if hook_type == 1:
+        u1 = np.linspace(np.pi, 0, n)
+        if hook_angle == 1:
+            y5 = D2/2*np.cos(u1)
+            x5 = np.zeros(len(u1))
+        elif hook_angle == 2:
+            x5 = D2/2*np.cos(u1[-1::-1])
+            y5 = np.zeros(len(u1[-1::-1]))
+
+        z5 = (D2/2*np.sin(u1)+D2/2+H+h+d)
+    elif hook_type == 2:
+        u1 = np.linspace(4*np.pi, 0, 4*n)
+        if hook_angle == 1:
+            x5 = ((-u1+2*np.pi)/(4*np.pi)*2*d)  # -.0625*d
+            y5 = D2/2*np.cos(u1)
+        if hook_angle == 2:
+            y5 = ((-u1+2*np.pi)/(4*np.pi)*2*d)  # +.5*d)
+            x5 = -D2/2*np.cos(u1)  # [-1::-1]
+        z5 = D2/2*np.sin(u1)+D2/2+H
+    elif hook_type == 3:
+        x5, y5, z5 = ([], [], [])
+
+    return [(x5, y5, z5), (x4, y4, z4), (x1, y1, z1), (x2, y2, z2),
+            (x3, y3, z3)]
+
+
+def centerline(parts):
+    """Joins the parts of spring_centerline into a single line from top to
+    bottom and measures it. Returns x, y, z and the length L"""
+    (x5, y5, z5), (x4, y4, z4), (x1, y1, z1) = parts[:3]
+    (x2, y2, z2), (x3, y3, z3) = parts[3:]
+
+    # Unifying all coordinates into a single entity
+    x = np.hstack([x5[:-1], x4, x1, x2, x3])
+    y = np.hstack([y5[:-1], y4, y1, y2, y3])
+    z = np.hstack([z5[:-1], z4, z1, z2, z3])
+
+    # length of the spring
+    last = len(x)-1
+    xa = np.power(x[1:]-x[0:last], 2)
+    ya = np.power(y[1:]-y[0:last], 2)
+    za = np.power(z[1:]-z[0:last], 2)
+    L = np.sum(np.sqrt(xa+ya+za))
+    return x, y, z, L
+
+
+def tube(points, d, ends, k=3):
+    """Vertices and faces of a wire of diameter d along the points, with
+    the rings of a curve bevel of resolution k and rounded caps. ends are
+    the lengths the (first, last) ring is extruded before closing each cap.
+    Also returns the index of the point each vertex belongs to."""
+    m = 4 + 2*k     # vertices per ring
+    size = len(points)
+    tangents = np.gradient(points, axis=0)
+    tangents /= np.sqrt(np.sum(np.power(tangents, 2), axis=1))[:, None]
+
+    # parallel transport of the normal, so the rings don't twist
+    normals = np.empty_like(points)
+    normal = np.cross(tangents[0], (0, 0, 1))
+    if np.linalg.norm(normal) < 1e-6:
+        normal = np.cross(tangents[0], (1, 0, 0))
+    for i, tangent in enumerate(tangents):
+        normal = normal - np.dot(normal, tangent)*tangent
+        normal /= np.linalg.norm(normal)
+        normals[i] = normal
+    binormals = np.cross(tangents, normals)
+    angle = 2*np.pi*np.arange(m)/m
+    rings = list(points[:, None] + d/2*(
+                        np.cos(angle)[:, None]*normals[:, None]
+                        + np.sin(angle)[:, None]*binormals[:, None]))
+
+    def cap(ring, center, direction, lengths):
+        """Rings extruded from the ring, the last one scaled to 0.7 and
+        the tip they close on"""
+        offset = np.cumsum(lengths)
+        out = [ring + o*direction for o in offset]
+        tip = center + offset[-1]*direction
+        out.append(tip + 0.7*(out[-1] - tip))
+        return out, tip
+
+    first, first_tip = cap(rings[0], points[0], -tangents[0], ends[0])
+    last, last_tip = cap(rings[-1], points[-1], tangents[-1], ends[1])
+    rings = first[::-1] + rings + last
+    owner = [0]*len(first) + list(range(size)) + [size-1]*len(last)
+    verts = np.vstack(rings + [first_tip, last_tip])
+
+    # quads between consecutive rings and triangle fans to the tips
+    index = np.arange(len(rings)*m).reshape(len(rings), m)
+    turn = np.roll(index, -1, axis=1)
+    quads = np.stack([index[:-1], turn[:-1], turn[1:], index[1:]], axis=-1)
+    start = np.column_stack([np.full(m, len(index)*m), turn[0], index[0]])
+    end = np.column_stack([index[-1], turn[-1], np.full(m, len(index)*m+1)])
+    faces = quads.reshape(-1, 4).tolist() + start.tolist() + end.tolist()
+    point_of = np.hstack([np.repeat(owner, m), [0, size-1]])
+    return verts, faces, point_of
+
+
+def bone_weights(points, heads, tails):
+    """Deform weights of the points for the bones, blending each point
+    between its nearest bone and the next one along the chain.
+    Returns the nearest bone, its neighbour and the neighbour weight."""
+    vec = tails - heads
+    length = np.maximum(np.sum(np.power(vec, 2), axis=1), 1e-12)
+    near = np.empty(len(points), dtype=int)
+    t = np.empty(len(points))
+    # blocks of points keep the distance matrix small for long springs
+    for start in range(0, len(points), 256):
+        rel = points[start:start+256, None] - heads[None]
+        block = np.clip(np.einsum('ijk,jk->ij', rel, vec)/length, 0, 1)
+        dist = np.sum(np.power(rel - block[:, :, None]*vec[None], 2), axis=2)
+        near[start:start+256] = np.argmin(dist, axis=1)
+        t[start:start+256] = block[np.arange(len(block)),
+                                   near[start:start+256]]
+    other = np.where(t < 0.5, near - 1, near + 1)
+    weight = np.where((other >= 0) & (other < len(heads)), abs(t - 0.5), 0)
+    return near, np.clip(other, 0, len(heads) - 1), weight
+
+
+def new_empty(name, collection, location, size):
+    empty = bpy.data.objects.new(name, None)
+    empty.empty_display_type = 'PLAIN_AXES'
+    empty.empty_display_size = size
+    empty.location = location
+    collection.objects.link(empty)
+    return empty
+
+
+def new_armature(name, collection, location, bones):
+    """Armature object in the collection with bones given as (name, head,
+    tail, parent index, connected).
+
+    Edit bones only exist in edit mode, so this is the only place that
+    switches modes: the armature is made active (linked to the scene for a
+    while if the collection is not) and edited once. Must be called in
+    object mode and leaves the armature active."""
+    armature = bpy.data.objects.new(name, bpy.data.armatures.new(name))
+    armature.location = location
+    collection.objects.link(armature)
+
+    view_layer = bpy.context.view_layer
+    scene_collection = view_layer.layer_collection.collection
+    linked = armature.name not in view_layer.objects
+    if linked:
+        scene_collection.objects.link(armature)
+    view_layer.objects.active = armature
+
+    bpy.ops.object.mode_set(mode='EDIT')
+    edit_bones = []
+    for bone_name, head, tail, parent, connect in bones:
+        bone = armature.data.edit_bones.new(bone_name)
+        bone.head = head
+        bone.tail = tail
+        if parent is not None:
+            bone.parent = edit_bones[parent]
+            bone.use_connect = connect
+        edit_bones.append(bone)
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    if linked:
+        scene_collection.objects.unlink(armature)
+    return armature
+
+
+def parent_to(child, parent, bone_name=""):
+    """Parents keeping the child in place, like parent_set. Works on a rig
+    in its rest position, where every object sits at its location."""
+    matrix = Matrix.Translation(parent.location)
+    child.parent = parent
+    if bone_name:
+        child.parent_type = 'BONE'
+        child.parent_bone = bone_name
+        bone = parent.data.bones[bone_name]
+        matrix = (matrix @ bone.matrix_local
+                  @ Matrix.Translation((0, bone.length, 0)))
+    child.matrix_parent_inverse = matrix.inverted()
+
+
+# ########### ENGINEERING PROPERTIES ##############
+
+# shear modulus (Pa) of the wire for every material: chromium, black oxide
+# and zinc coated spring steel and stainless steel
+SHEAR_MODULUS = (79.3e9, 79.3e9, 69.0e9, 79.3e9)
+
+# custom property names and their scale from SI units
+PROPERTIES = (("Active turns", 1),
+              ("Spring rate [N/mm]", 1e-3),
+              ("Solid height [mm]", 1e3),
+              ("Free length [mm]", 1e3),
+              ("Wire length [mm]", 1e3),
+              ("Max stress [MPa]", 1e-6))
+
+# engineering properties by generator parameters, see spring_properties
+property_table = {}
+
+
+def wire_length(D, d, D2, H, h, hook_type=1, hook_angle=1):
+    """Length of the central line of the spring (L in generate_spring)"""
+    d, D2, kn, p = spring_dimensions(D, d, D2, H)
+    N = int(15*p*H//1)
+    if hook_angle == 2:
+        p = p + 0.25/H
+    parts = spring_centerline(D, d, D2, H, h, p, N, hook_type, hook_angle)
+    return centerline(parts)[3]
+
+
+def spring_properties(springs, lengths=None):
+    """Engineering properties of a batch of springs, like the whole
+    catalog, given as rows of generator parameters (D, d, D2, H, h,
+    hook_type, hook_angle, mat) in meters. lengths are the wire lengths
+    already known for the rows (L from generate_spring) or None.
+
+    Springs already in property_table are looked up, the rest are
+    computed in one vectorized pass and added to it, except for the wire
+    length of springs not given in lengths: that needs the central line
+    of each spring. Returns an (n, 6) array in SI units with the columns
+    of PROPERTIES: active turns, spring rate, solid height, free length,
+    wire length and the maximum (Wahl corrected) shear stress.
+
+    The maximum stress is taken at the largest deflection of each kind of
+    spring: springs without hooks (hook_type 3) work in compression and
+    are pressed to solid height, hook springs work in extension and are
+    stretched by the height of their coil H, to twice its length. It is
+    nan for compression springs whose solid height reaches their free
+    length."""
+    keys = [tuple(float(v) for v in row) for row in springs]
+    if lengths is None:
+        lengths = [None]*len(keys)
+    known = dict(zip(keys, lengths))
+    missing = [key for key in known if key not in property_table]
+    if missing:
+        D, d, D2, H, h, hook_type, hook_angle, mat = np.array(missing).T
+        if np.any((mat % 1 != 0) | (mat < 0)
+                  | (mat >= len(SHEAR_MODULUS))):
+            raise ValueError(f"mat must be an integer from 0 to "
+                             f"{len(SHEAR_MODULUS)-1}")
+        length = [wire_length(*key[:5], int(key[5]), int(key[6]))
+                  if known[key] is None else known[key] for key in missing]
+        d, D2, kn, p = spring_dimensions(D, d, D2, H)
+
+        turns = kn + 0.25*(hook_angle == 2)
+        G = np.array(SHEAR_MODULUS)[mat.astype(int)]
+        rate = G*np.power(d, 4)/(8*np.power(D, 3)*turns)
+        solid = (turns + 1)*d
+        free = np.select([hook_type == 1, hook_type == 2],
+                         [H + 2*(D2 + h + d) + d, H + 2*D2 + d], H)
+        # compression springs pressed to solid height, extension springs
+        # stretched to twice the coil height
+        deflection = np.where(hook_type == 3, free - solid, H)
+        C = D/d
+        wahl = (4*C - 1)/(4*C - 4) + 0.615/C
+        force = rate*deflection
+        stress = wahl*8*force*D/(np.pi*np.power(d, 3))
+        stress[deflection <= 0] = np.nan
+
+        table = np.column_stack([turns, rate, solid, free, length, stress])
+        property_table.update(zip(missing, table))
+    return np.array([property_table[key] for key in keys])
+
+
+def set_spring_properties(ob, row):
+    """Custom properties of the object from a row of spring_properties,
+    undefined (nan) values are left out"""
+    for (name, scale), value in zip(PROPERTIES, row):
+        if np.isnan(value):
+            if name in ob:
+                del ob[name]
+        else:
+            ob[name] = float(value*scale)
+
+
+def fit_circle(u, v):
+    """Center (cu, cv) and radius of the circle through the points (u, v),
+    least squares"""
+    A = np.column_stack([u, v, np.ones(len(u))])
+    (a, b, c), *_ = np.linalg.lstsq(A, -(u*u + v*v), rcond=None)
+    return -a/2, -b/2, np.sqrt(a*a/4 + b*b/4 - c)
+
+
+def measure_spring(points, first, last, wire):
+    """Generator parameters (D, d, D2, H, h, hook_type, hook_angle) of a
+    spring measured from its rig in the rest pose.
+
+    points: (n, 3) heads of the bones of the central armature
+    first, last: the coil bones (the IK chain, see coil_bones)
+    wire: (m, 3) vertices of the spring mesh in armature space
+
+    The coil bones start on a helix of radius D/2+d going down H, their
+    angle gives the active turns and the hook angle (a quarter of a turn
+    more for hook_angle 2). The wire in the middle of the coil is a tube
+    of diameter d around the helix of radius D/2 rising like the bones.
+    The upper hook bones but the last 4 (the "s" segment down to the
+    coil) lie on the hook circle, of diameter D2 and centered h+d+D2/2
+    over the coil. The loop of hook_type 2 goes twice around it, centered
+    D2/2 over the coil, and springs without hooks have no bones over it.
+
+    The parameters are the ones to give the generator: spring_dimensions
+    turns them into the measured d, D2 and number of turns."""
+    coil = points[first:last + 1]
+    cx, cy, r = fit_circle(coil[:, 0], coil[:, 1])
+    # the chain can miss a bone or two of the coil, when remove_doubles
+    # took points out of the hooks, the coil goes on while the bones stay
+    # on the helix
+    on = np.isclose(np.hypot(points[:, 0] - cx, points[:, 1] - cy), r,
+                    rtol=1e-3)
+    while first > 0 and on[first - 1]:
+        first -= 1
+    while last < len(points) - 1 and on[last + 1]:
+        last += 1
+    coil = points[first:last + 1]
+    angle = np.unwrap(np.arctan2(coil[:, 1] - cy, coil[:, 0] - cx))
+    turns = abs(angle[-1] - angle[0])/(2*np.pi)
+    hook_angle = 2 if round(4*turns) % 4 == 1 else 1
+    kn = round(turns - 0.25*(hook_angle == 2))
+    bottom = coil[-1, 2]
+    H = coil[0, 2] - bottom
+
+    # every vertex of the wire is d/2 from the centerline, a helix of
+    # radius D/2 rising like the bones: (rho - D/2)^2 + dz^2 = d^2/4, with
+    # dz taken across the wire (tilted like the helix)
+    slope, z0 = np.polyfit(angle, coil[:, 2], 1)
+    band = np.abs(wire[:, 2] - bottom - H/2) < H/4
+    rho = np.hypot(wire[band, 0] - cx, wire[band, 1] - cy)
+    phi = np.arctan2(wire[band, 1] - cy, wire[band, 0] - cx)
+    turn = np.round(((wire[band, 2] - z0)/slope - phi)/(2*np.pi))
+    dz = wire[band, 2] - z0 - slope*(phi + 2*np.pi*turn)
+    A = np.column_stack([2*rho, np.ones(len(rho))])
+    R = r
+    for _ in range(2):
+        across = dz*R/np.hypot(R, slope)
+        (R, c), *_ = np.linalg.lstsq(A, rho*rho + across*across, rcond=None)
+    D = 2*R
+    d = 2*np.sqrt(c + R*R)
+
+    hook = points[:first]
+    if len(hook) <= 4 or np.max(hook[:, 2]) < coil[0, 2] + d:
+        # flat ends, the coil bones keep 0.15*d from the ends
+        hook_type, H, D2, h = 3, H + 0.3*d, D, 0
+    else:
+        # the hook circle is in a plane through the axis
+        loop = hook[:-4]
+        offset = loop[:, :2] - (cx, cy)
+        s = offset @ np.linalg.svd(offset, full_matrices=False)[2][0]
+        z = loop[:, 2] - bottom
+        sc, zc, radius = fit_circle(s, z)
+        around = np.unwrap(np.arctan2(z - zc, s - sc))
+        hook_type = 2 if abs(around[-1] - around[0]) > 2*np.pi else 1
+        D2 = 2*radius
+        h = max(zc - H - D2/2 - d, 0) if hook_type == 1 else 0
+
+    # the turns are counted before d is reduced to fit the coil or the hook:
+    # kn <= (H - 0.1*d)/(1.1*d) < kn + 1 for the d given to the generator
+    wire_d = d
+    d = np.clip(d, H/(1.1*kn + 1.2)*(1 + 1e-6), H/(1.1*kn + 0.1)*(1 - 1e-6))
+    if not np.isclose(spring_dimensions(D, d, D2, H)[0], wire_d, rtol=1e-3):
+        D2 = 2*wire_d
+    return (float(D), float(d), float(D2), float(H), float(h), hook_type,
+            hook_angle)
+
+
+def rig_parameters(armature, mat=0):
+    """Generator parameters of a spring rig that doesn't store them, like
+    the springs of the catalog, see measure_spring. The material can't be
+    measured and is given by mat. None if the rig has no spring mesh"""
+    mesh = next((ob for ob in armature.children if ob.type == 'MESH'), None)
+    if mesh is None:
+        return None
+    bones = armature.data.bones
+    points = np.empty((len(bones), 3), dtype=np.float32)
+    bones.foreach_get('head_local', points.ravel())
+    wire = np.empty((len(mesh.data.vertices), 3), dtype=np.float32)
+    mesh.data.vertices.foreach_get('co', wire.ravel())
+    matrix = (np.linalg.inv(np.array(armature.matrix_world))
+              @ np.array(mesh.matrix_world))
+    wire = wire @ matrix[:3, :3].T + matrix[:3, 3]
+    return measure_spring(points.astype(float), *coil_bones(armature),
+                          wire) + (mat,)
+
+
+def generate_spring(collection, location=(0, 0, 0), D=0.015, d=0.002,
+                    D2=0.015, H=0.035, h=0.0, hook_type=1, hook_angle=1,
+                    mat=0):
+    """Creates a rigged spring in the collection with the base of the coil
+    at location. Lengths are in meters, see MESH_OT_springs for the meaning
+    of the arguments.
+
+    Everything is built through the data API: no cursor, selection, view
+    or scene settings are used, so it runs from scripts and in background
+    mode (blender -b) in any scene. Only the armatures need edit mode; the
+    caller's mode and active object are restored after building them.
+
+    The spring is created in the following steps:
+    ===============================================
+    A) Calculate the points of the central line (see spring_centerline)
+    B) Build the wire mesh around it with caps at both open ends
+    C) Build the central & control armatures and the drivers
+    D) Add constraints, parents and deform weights
+
+    The engineering properties of the spring (see spring_properties) are
+    added to the mesh as custom properties.
+
+    Returns a dict with the new objects: mesh, armature, upper_armature,
+    lower_armature, upper_driver and lower_driver"""
+    # ########### VARIABLE CONSTRAITNS ##############
+
+    parameters = (D, d, D2, H, h, hook_type, hook_angle, mat)
+    d, D2, kn, p = spring_dimensions(D, d, D2, H)
+    n = 10     # number of hooks longitudinal steps
+    N = int(15*p*H//1)  # nomber of spiral longitudinal steps/turn
+    k = 3      # radial resolution
+    if hook_angle == 2:
+        p = p + 0.25/H
+    location = np.array(location, dtype=float)
+
+    if hook_type == 1:
+        up_location = np.array((0, 0, H + D2/2 + h + d))
+        lo_location = np.array((0, 0, -D2/2-h-d))
+    elif hook_type == 2:
+        up_location = np.array((0, 0, H + D2/2))
+        lo_location = np.array((0, 0, -D2/2))
+    elif hook_type == 3:
+        up_location = np.array((0, 0, H))
+        lo_location = np.array((0, 0, 0))
+
+    # ########### CALCULATE POINTS FOR CENTRAL LINE ##############
+
+    parts = spring_centerline(D, d, D2, H, h, p, N, hook_type, hook_angle, n)
+    (x5, y5, z5), (x4, y4, z4), _, (x2, y2, z2), (x3, y3, z3) = parts
+    x, y, z, L = centerline(parts)
+
+    # ########### SPRING MESH ##############
+
+    x, y, z = remove_doubles(x, y, z)
+    wire = np.column_stack([x, y, z]) - lo_location
+    if hook_type == 1:
+        ends = ([0.2*D2, 0.1*d], [0.2*D2, 0.1*d])
+    elif hook_type == 2:
+        ends = ([0.1*d], [0.1*d])
+    elif hook_type == 3:
+        ends = ([0.1*L/(N+4*n+1)], [0.15*L/(N+4*n+1)])
+    verts, faces, point_of = tube(wire, d, ends, k)
+
+    mesh = bpy.data.meshes.new("Spring mesh")
+    mesh.from_pydata(verts.tolist(), [], faces)
+    spring = bpy.data.objects.new("Spring mesh", mesh)
+    spring.location = location + lo_location
+    collection.objects.link(spring)
+
+    # ########### ARMATURES ##############
+
+    # Central spring armature
+    x1, y1, z1 = coil_points(D+2*d, d, H, p, int(N/3), hook_type == 3)
+
+    x_up_hook = np.hstack([x5[::3],  x4[::3]])
+    y_up_hook = np.hstack([y5[::3],  y4[::3]])
+    z_up_hook = np.hstack([z5[::3],  z4[::3]])
+    up_len = len(x_up_hook)
+
+    x_lo_hook = np.hstack([x2[::3],  x3[::3]])
+    y_lo_hook = np.hstack([y2[::3],  y3[::3]])
+    z_lo_hook = np.hstack([z2[::3],  z3[::3]])
+    lo_len = len(x_lo_hook)
+
+    x = np.hstack([x_up_hook, x1, x_lo_hook])
+    y = np.hstack([y_up_hook, y1, y_lo_hook])
+    z = np.hstack([z_up_hook, z1, z_lo_hook])
+    x, y, z = remove_doubles(x, y, z)
+    points = np.column_stack([x, y, z])
+    size = len(points)
+
+    # Mark the two middle bones with digital signature just for fun :-)
+    if size-2 >= 17:
+        position = 17
+    else:
+        position = 7
+    chain = []
+    for i in range(size-1):
+        name = 'Elbio Peña' if i in (8, position) else "Bone"
+        chain.append((name, points[i] - lo_location,
+                      points[i+1] - lo_location, i-1 if i else None, True))
+
+    # control armatures, the anchors are tiny bones along the ends of the
+    # coil
+    coord_1 = points[up_len-1]
+    coord_2 = points[up_len-2]
+    coord_3 = coord_2 + (coord_1 - coord_2)/100
+    up_bones = [("Upper guide", (0, 0, 0), (0, 0, -D/25), None, False),
+                ("Upper anchor", coord_2 - up_location,
+                 coord_3 - up_location, 0, False)]
+
+    coord_1 = points[size-lo_len-1]
+    coord_2 = points[size-lo_len]
+    coord_3 = coord_2 + (coord_2 - coord_1)/100
+    lo_bones = [("Lower guide", (0, 0, 0), (0, 0, D/25), None, False),
+                ("Lower anchor", coord_2 - lo_location,
+                 coord_3 - lo_location, 0, False)]
+
+    # the armatures need edit mode, the caller's mode and active object
+    # are given back afterwards
+    view_layer = bpy.context.view_layer
+    active = view_layer.objects.active
+    mode = active.mode if active is not None else 'OBJECT'
+    if mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+    try:
+        spring_armature = new_armature("Spring armature", collection,
+                                       location + lo_location, chain)
+        up_armature = new_armature("Upper armature", collection,
+                                   location + up_location, up_bones)
+        lo_armature = new_armature("Lower armature", collection,
+                                   location + lo_location, lo_bones)
+    finally:
+        view_layer.objects.active = active
+        if mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode=mode)
+    spring_armature['wire_diameter'] = d
+    spring_armature['spring_parameters'] = [float(v) for v in parameters]
+
+    # drivers
+    up_driver = new_empty("Upper driver", collection,
+                          location + up_location, 0.55*D)
+    lo_driver = new_empty("Lower driver", collection,
+                          location + lo_location, 0.55*D)
+
+    # ########### CONSTRAINTS AND PARENTS ##############
+
+    # Add damped track constraints upper and lower guides
+    for armature, target in ((up_armature, lo_driver),
+                             (lo_armature, up_driver)):
+        bone_constraint = armature.pose.bones[0].constraints.new(
+                                                            'DAMPED_TRACK')
+        bone_constraint.target = target
+        bone_constraint.track_axis = 'TRACK_Y'
+        bone_constraint.influence = 1.0
+
+    # add iverse kinematics to spring armature last bone
+    ik = spring_armature.pose.bones[size-lo_len-1].constraints.new('IK')
+    ik.target = lo_armature
+    ik.subtarget = "Lower anchor"
+    ik.chain_count = size-lo_len-up_len
+    ik.use_tail = True
+    ik.use_stretch = True
+    ik.use_location = True
+    ik.use_rotation = True
+    ik.weight = 1.0
+    ik.orient_weight = 1.0
+    ik.influence = 1.0
+
+    constraint = lo_driver.constraints.new('COPY_ROTATION')
+    constraint.target = up_driver
+
+    parent_to(up_armature, up_driver)
+    parent_to(lo_armature, lo_driver)
+    # parent spring armature to upper anchor
+    parent_to(spring_armature, up_armature, "Upper anchor")
+
+    # parent spring mesh to spring armature with weights along the chain
+    bones = spring_armature.data.bones
+    for bone in bones:
+        spring.vertex_groups.new(name=bone.name)
+    heads = np.array([bone.head_local for bone in bones])
+    tails = np.array([bone.tail_local for bone in bones])
+    near, other, weight = bone_weights(wire, heads, tails)
+
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    deform = bm.verts.layers.deform.verify()
+    for vert, i in zip(bm.verts, point_of):
+        vert[deform][int(near[i])] = 1 - weight[i]
+        if weight[i] > 0:
+            vert[deform][int(other[i])] = weight[i]
+
+    # grind the ends of springs without hooks flat
+    if hook_type == 3:
+        for co, no in (((0, 0, -lo_location[2]), (0, 0, -1)),
+                       ((0, 0, H-lo_location[2]), (0, 0, 1))):
+            cut = bmesh.ops.bisect_plane(
+                            bm, geom=bm.verts[:] + bm.edges[:] + bm.faces[:],
+                            plane_co=co, plane_no=no, clear_outer=True)
+            bmesh.ops.holes_fill(bm, edges=[
+                            e for e in cut['geom_cut']
+                            if isinstance(e, bmesh.types.BMEdge)])
+    bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=0.00001)
+    for face in bm.faces:
+        face.smooth = True
+    bm.to_mesh(mesh)
+    bm.free()
+
+    modifier = spring.modifiers.new("Armature", 'ARMATURE')
+    modifier.object = spring_armature
+    parent_to(spring, spring_armature)
+
+    # final settings
+    spring.hide_select = False
+    spring_armature.hide_render = True
+    up_armature.hide_render = True
+    lo_armature.hide_render = True
+    spring_armature.display_type = "BOUNDS"
+    set_spring_properties(spring, spring_properties([parameters], [L])[0])
+
+    return {'mesh': spring, 'armature': spring_armature,
+            'upper_armature': up_armature, 'lower_armature': lo_armature,
+            'upper_driver': up_driver, 'lower_driver': lo_driver}
+
+
 class MESH_OT_springs(bpy.types.Operator):
     """"Generates tension spring and compresion spring meshes"""
     bl_idname = "mesh.add_springs"
@@ -63,668 +864,586 @@ class MESH_OT_springs(bpy.types.Operator):
         default=0)
 
     def execute(self, context):
-        """This creates the spring in the following steps:
-        ===============================================
-        A)Draw the mesh
-        ---------------
-        I ) First calculate the points of the central line inside the coil of
-            the spring, in 5 parts (the order is different in the code):
-                1-lower hook
-                2-lower segment conecting hook and coil
-                3-coil
-                4-upper segment conecting hook and coil
-                5-upper hook
-        II) Draw spring central line with the coordinates of the points by
-            creating a point and extruding the point trhough each coordinates.
-        III)Convert to spline and from spline to mesh with offset = coil diam.
-
-        B)Draw caps at both open ends
-        -----------------------------
-        C) Draw central & control armatures
-        -----------------------------------
-        D)Add constraints to the armatures
-        ----------------------------------"""
-        # ########### INITIAL SETTINGS ##############
-
+        """Generates the spring at the 3D cursor in a new collection named
+        after its dimensions (see generate_spring)"""
         # trasform to millimeters
-        self.D = self.D/1000
-        self.d = self.d/1000
-        self.D2 = self.D2/1000
-        self.H = self.H/1000
-        self.h = self.h/1000
-
-        # Save current settings
-        scene = bpy.data.scenes["Scene"]
-        pivot_point = scene.tool_settings.transform_pivot_point
-        orientation = scene.transform_orientation_slots[0].type
-        auto_merge = scene.tool_settings.use_mesh_automerge
-        unit_system = scene.unit_settings.system
-        scale_length = scene.unit_settings.scale_length
-        unit_length = scene.unit_settings.length_unit
-        cursor_loc = list(scene.cursor.location)
-
-        scene.tool_settings.transform_pivot_point = 'ACTIVE_ELEMENT'
-        scene.tool_settings.use_mesh_automerge = False
-        scene.unit_settings.system = 'METRIC'
-        scene.unit_settings.scale_length = 1
-        scene.unit_settings.length_unit = 'MILLIMETERS'
-        scene.cursor.location = (0, 0, 0)
-        scene.transform_orientation_slots[0].type = 'GLOBAL'
-
-        # ########### VARIABLE CONSTRAITNS ##############
-
-        # Adjust pitch for integer number of turns
-        print(self.H, self.d)
-        kn = (self.H - 0.1*self.d)/(1.1*self.d)//1
-        self.p = kn/self.H
-
-        # decrease wire diam if outside diam or hook diam gets too small
-        if 3*self.d > self.D:
-            self.d = self.D/2
-        if 2*self.d > self.D2:
-            self.d = self.D2/2
-        # stop increasing hook diam if it gets too big
-        if self.D2 > 1.5*self.D:
-            self.D2 = 1.5*self.D
-        # stop decreasing hook diam if it gets too small
-        if self.D2 < self.D/1.5:
-            self.D2 = self.D/1.5
-
-        n = 10     # number of hooks longitudinal steps
-        N = 15*self.p*self.H//1  # nomber of spiral longitudinal steps/turn
-        k = 3      # radial resolution
-
-        # ########### CALCULATE POINTS FOR CENTRAL LINE ##############
-
-        def remove_doubles(x, y, z):
-            """unique values for dots with euclidean distance less than
-            0.00001 which are esentially the same point"""
-            size = len(x)
-            xi = x[1:]-x[0:size-1]
-            yi = y[1:]-y[0:size-1]
-            zi = z[1:]-z[0:size-1]
-            dist = np.sqrt(np.power(xi, 2) + np.power(yi, 2) + np.power(zi, 2))
-            index = np.where(dist <= 0.00001)
-            x = np.delete(x, index)
-            y = np.delete(y, index)
-            z = np.delete(z, index)
-            print(f"Removed {size-len(x)} vertices...")
-            return x, y, z
-
-        if self.hook_angle == 2:
-            self.p = self.p + 0.25/self.H
-
-        #  coil coordinates
-        u = np.linspace(self.H, 0, N)
-
-        if self.hook_type == 3:
-            z1 = np.linspace(self.H-0.3*self.d/2,  0+0.3*self.d/2,  N)
-        else:
-            z1 = u
-        x1 = (self.D/2)*np.cos(2*np.pi*self.p*u)
-        y1 = (self.D/2)*np.sin(2*np.pi*self.p*u)
-
-        def find_angle(x, y):
-            angle = round(np.arctan(y/x), 2)
-            if x < 0 and y > 0:
-                angle += np.pi
-            elif x < 0 and y < 0:
-                angle += np.pi
-            elif x > 0 and y < -0.00001:
-                angle += 2*np.pi
-            return angle
-        alpha = find_angle(x1[0], y1[0])
-
-        # angles for the "s" segments
-        if self.hook_type == 1 or self.hook_type == 2:
-            li = 7              # length ratio li:1
-            sleng = np.zeros(n + 1)   # segments lengths
-            rate = (li-1)/(n-1)
-            for i in range(n):
-                sleng[i] = 6 - i*rate
-            sleng = 1/2*np.pi*sleng/np.sum(sleng)
-
-            u = np.hstack([[2*np.pi],  np.zeros(n)])
-            for i in range(n):
-                u[i+1] = 2*np.pi - np.sum(sleng[0:i+1])
-        elif self.hook_type == 3:
-            last = (4*np.pi/5)*(0.5)/(self.d*self.p)
-            if last > 4/3*np.pi:
-                last = 4/3*np.pi
-            u = np.linspace(0, last, n)
-
-        # Lower s segment
-        if self.hook_type == 1:
-            x2 = self.D/2*abs(np.cos(u))
-            XG2 = self.D2/2*abs(np.cos(u))
-            y2 = self.D2/2*np.sin(u)
-            z2 = np.sqrt(abs((self.D2/2)**2-np.power(XG2,  2)))-self.D2/2
-            z2 = z2[-1::-1]
-        elif self.hook_type == 2:
-            x2 = (self.D/2-1.025*self.d)*abs(np.cos(u))+1.025*self.d
-            XG2 = self.D2/2*abs(np.cos(u))
-            y2 = self.D2/2*np.sin(u)
-            z2 = np.sqrt(abs((self.D2/2)**2-np.power(XG2,  2)))-self.D2/2
-            z2 = z2[-1::-1]
-        elif self.hook_type == 3:
-            x2 = self.D/2*np.cos(u)
-            y2 = -self.D/2*np.sin(u)
-            z2 = np.zeros(len(u))+0.3*self.d/2
-
-        # Upper s segment
-        if self.hook_type == 1:
-            u1 = u[-1::-1]
-            if self.hook_angle == 1:
-                x4 = self.D/2*(np.cos(u1+alpha))
-                XG4 = self.D2/2*(abs(np.cos(u1)))
-                y4 = self.D2/2*(-np.sin(u1+alpha))
-            elif self.hook_angle == 2:
-                x4 = self.D2/2*(-np.cos(u1+alpha))
-                XG4 = self.D2/2*(abs(np.cos(u1)))
-                y4 = (self.D/2)*(np.sin(u1+alpha))
-            z4 = -np.sqrt(abs((self.D2/2)**2-np.power(XG4, 2)))
-            z4 = (z4 + self.D2/2 + self.H)[-1::-1]
-
-        elif self.hook_type == 2:
-            u1 = u[-1::-1]
-            if self.hook_angle == 1:
-                x4 = (self.D/2-1.01*self.d)*abs(np.cos(u1))+1.01*self.d
-                XG4 = self.D2/2*(abs(np.cos(u1)))
-                y4 = self.D2/2*(- np.sin(u1))
-            elif self.hook_angle == 2:
-                x4 = -(self.D2/2)*np.cos(u1 + alpha)
-                XG4 = self.D2/2*(abs(np.cos(u1)))
-                y4 = (self.D/2-1.01*self.d)*(np.sin(u1 + alpha))+1.01*self.d
-            z4 = -np.sqrt(abs((self.D2/2)**2-np.power(XG4, 2)))
-            z4 = (z4 + self.D2/2 + self.H)[-1::-1]
-        elif self.hook_type == 3:
-            u1 = u + alpha
-            x4 = self.D/2*np.cos(u1[-1::-1])
-            y4 = self.D/2*np.sin(u1[-1::-1])
-            z4 = np.full(len(u), self.H)-0.3*self.d/2
-
-        # lower circular segment
-        if self.hook_type == 1:
-            u1 = np.linspace(np.pi, 2*np.pi, n)
-            y3 = self.D2/2*np.cos(u1)
-            z3 = self.D2/2*np.sin(u1)-self.D2/2-self.h-self.d
-            x3 = self.D/2*np.zeros(len(u1))
-
-        elif self.hook_type == 2:
-            u1 = np.linspace(4*np.pi, 0, 4*n)
-            x3 = ((u1-2*np.pi)/(4*np.pi)*2.05*self.d)
-            y3 = -self.D2/2*np.cos(u1)
-            z3 = self.D2/2*(-np.sin(u1)-1)[-1::-1]
-        elif self.hook_type == 3:
-            x3, y3, z3 = ([], [], [])
-
-        # Upper circular segment
-        if self.hook_type == 1:
-            u1 = np.linspace(np.pi, 0, n)
-            if self.hook_angle == 1:
-                y5 = self.D2/2*np.cos(u1)
-                x5 = np.zeros(len(u1))
-            elif self.hook_angle == 2:
-                x5 = self.D2/2*np.cos(u1[-1::-1])
-                y5 = np.zeros(len(u1[-1::-1]))
-
-            z5 = (self.D2/2*np.sin(u1)+self.D2/2+self.H+self.h+self.d)
-        elif self.hook_type == 2:
-            u1 = np.linspace(4*np.pi, 0, 4*n)
-            if self.hook_angle == 1:
-                x5 = ((-u1+2*np.pi)/(4*np.pi)*2*self.d)  # -.0625*self.d
-                y5 = self.D2/2*np.cos(u1)
-            if self.hook_angle == 2:
-                y5 = ((-u1+2*np.pi)/(4*np.pi)*2*self.d)  # +.5*self.d)
-                x5 = -self.D2/2*np.cos(u1)  # [-1::-1]
-            z5 = self.D2/2*np.sin(u1)+self.D2/2+self.H
-        elif self.hook_type == 3:
-            x5, y5, z5 = ([], [], [])
-
-        # Unifying all coordinates into a single entity
-        x = np.hstack([x5[:-1], x4, x1, x2, x3])
-        y = np.hstack([y5[:-1], y4, y1, y2, y3])
-        z = np.hstack([z5[:-1], z4, z1, z2, z3])
-
-        # length of the spring
-        last = len(x)-1
-        xa = np.power(x[1:]-x[0:last], 2)
-        ya = np.power(y[1:]-y[0:last], 2)
-        za = np.power(z[1:]-z[0:last], 2)
-        L = np.sum(np.sqrt(xa+ya+za))
-
-        self.D = self.D+self.d
-        self.D2 = self.D2-self.d
-
-        # Create name based upon the dimensions
-        # wire thickness x coil_outside_diam x hook_inside_diam x
-        # distance_between_hook_centers
-        name = ""
-        if (self.d*1000) % 1 > 0.1:
-            name += str(round(self.d*1000, 2))
-        else:
-            name += str(int(self.d*1000))
+        D = self.D/1000
+        d = self.d/1000
+        D2 = self.D2/1000
+        H = self.H/1000
+        h = self.h/1000
+
+        wire, hook, kn, p = spring_dimensions(D, d, D2, H)
+        collection = bpy.data.collections.new(
+                            spring_name(D, wire, hook, H, h, self.hook_type))
+        context.scene.collection.children.link(collection)
+        layer = context.view_layer.layer_collection.children[collection.name]
+        context.view_layer.active_layer_collection = layer
+
+        rig = generate_spring(collection, context.scene.cursor.location,
+                              D, d, D2, H, h, self.hook_type, self.hook_angle,
+                              self.mat)
+
+        # show the adjusted values
+        self.d = wire*1000
+        self.D2 = hook*1000
+        self.p = p
+        self.__spring_bones = len(rig['armature'].data.bones)
+
+        for ob in context.selected_objects:
+            ob.select_set(False)
+        for name in ('mesh', 'upper_driver', 'upper_armature',
+                     'lower_driver', 'lower_armature'):
+            rig[name].select_set(True)
+        context.view_layer.objects.active = rig['lower_driver']
+        return {'FINISHED'}
 
-        if (self.D*1000) % 1 > 0.1:
-            name += " x " + str(round(self.D*1000, 1))
-        else:
-            name += " x " + str(int(self.D*1000))
 
-        if self.hook_type == 1 or self.hook_type == 2:
-            if round(self.D2*1000, 3) % 1 > 0.01:
-                name += " x " + str(round(self.D2*1000, 1))
-                print(self.D2*1000)
-            else:
-                name += " x " + str(int(round(self.D2*1000, 3)))
+# ########### CLASH DETECTION ##############
+
+def segment_distances(p0, p1, q0, q1):
+    """Closest distance between the segments p0-p1 and q0-q1, row by row.
+    All the arguments are (n, 3) arrays."""
+    u = p1 - p0
+    v = q1 - q0
+    w = p0 - q0
+    a = np.maximum(np.einsum('ij,ij->i', u, u), 1e-12)
+    b = np.einsum('ij,ij->i', u, v)
+    c = np.maximum(np.einsum('ij,ij->i', v, v), 1e-12)
+    e = np.einsum('ij,ij->i', u, w)
+    f = np.einsum('ij,ij->i', v, w)
+
+    # parameters of the closest points of the infinite lines, parallel
+    # segments start from the head of the first one
+    den = a*c - b*b
+    parallel = den <= 1e-12*a*c
+    s = np.clip((b*f - c*e)/np.where(parallel, 1, den), 0, 1)
+    s[parallel] = 0
+    t = (b*s + f)/c
+    # clamp to the second segment and recompute the first
+    s = np.where(t < 0, np.clip(-e/a, 0, 1), s)
+    s = np.where(t > 1, np.clip((b - e)/a, 0, 1), s)
+    t = np.clip(t, 0, 1)
+
+    diff = w + s[:, None]*u - t[:, None]*v
+    return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+
+def wire_samples(heads, tails, d, step=1):
+    """Number of points wire_clashes samples on every segment: one every
+    step wire diameters, both ends included"""
+    length = np.sqrt(np.sum(np.power(tails - heads, 2), axis=1))
+    return (np.ceil(length/(step*d)) + 1).astype(np.int32)
+
+
+def wire_clashes(heads, tails, groups, d, ignore=None, size=None):
+    """Pairs of segments of the same group whose wires intersect.
+
+    heads, tails: (n, 3) end points of the segments (wire centerline)
+    groups: (n,) id of the spring and frame each segment belongs to
+    d: (n,) wire diameter of each segment
+    ignore: sorted keys a*size + b of the pairs to leave out, with the
+        segment indices taken modulo size (the bones of a block of frames
+        repeat every size segments)
+
+    The segments of a group form a chain, so consecutive segments, which
+    always touch at their joint, are never reported.
+
+    Every segment is sampled every wire diameter and the samples are hashed
+    in cells of 2 diameters, so candidate pairs are only looked up among
+    the 27 neighbour cells. Joined and ignored pairs are dropped before
+    measuring any distance. Returns the indices a < b of the clashing
+    segments and their centerline distance in wire diameters."""
+    step = 1
+    cell = 1 + step
+
+    def distinct(values):
+        values = np.sort(values)
+        keep = np.ones(len(values), dtype=bool)
+        keep[1:] = values[1:] != values[:-1]
+        return values[keep]
+
+    # work in units of wire diameter so all the springs share one grid
+    count = wire_samples(heads, tails, d, step)
+    heads = (heads/d[:, None]).astype(np.float32)
+    tails = (tails/d[:, None]).astype(np.float32)
+    seg = np.repeat(np.arange(len(heads), dtype=np.int32), count)
+    first = (np.cumsum(count) - count).astype(np.int32)
+    t = ((np.arange(len(seg), dtype=np.int32) - first[seg])
+         / np.maximum(count - 1, 1).astype(np.float32)[seg])
+    points = heads[seg] + t[:, None]*(tails - heads)[seg]
+    del t
+
+    # cells relative to the corner of each group keep the keys small, the
+    # samples of a segment lie between the cells of its ends
+    group_ids, group = np.unique(groups, return_inverse=True)
+    group = group.astype(np.int32)
+    ends = np.minimum(np.floor(heads/cell), np.floor(tails/cell))
+    corner = np.full((len(group_ids), 3), np.inf, dtype=np.float32)
+    np.minimum.at(corner, group, ends)
+    group = group[seg]
+    cells = np.floor(points/cell).astype(np.int32)
+    del points
+    cells -= corner.astype(np.int32)[group] - 1
+    dims = cells.max(axis=0).astype(np.int64) + 2
+    strides = np.array([dims[1]*dims[2], dims[2], 1])
+
+    # a segment only needs to be listed once in every cell it crosses
+    keys = group*(dims[0]*strides[0]) + cells @ strides
+    del group, cells
+    keys, index = np.unique(keys*len(heads) + seg, return_index=True)
+    keys //= len(heads)
+    seg = seg[index]
+    del index
+
+    # occupied cells, where their segments start in seg and how many
+    new = np.hstack([True, keys[1:] != keys[:-1]])
+    cell_of = np.cumsum(new, dtype=np.int32) - 1
+    start = np.flatnonzero(new).astype(np.int32)
+    count = np.diff(np.append(start, np.int32(len(keys))))
+    keys = keys[start]
+    del new
+
+    # half of the neighbour cells is enough to meet every pair of cells.
+    # The margin of one cell around every group keeps the keys of the
+    # neighbours at a fixed offset, so they stay sorted like the keys
+    candidates = []
+    for offset in product((-1, 0, 1), repeat=3):
+        if offset < (0, 0, 0):
+            continue
+        near = keys + int(np.dot(offset, strides))
+        at = np.minimum(np.searchsorted(keys, near), len(keys) - 1)
+        hit = keys[at] == near
+        lo = np.where(hit, start[at], 0)[cell_of]
+        found = np.where(hit, count[at], 0)[cell_of]
+        a = np.repeat(seg, found)
+        b = seg[np.arange(len(a), dtype=np.int32)
+                - np.repeat(np.cumsum(found, dtype=np.int32) - found - lo,
+                            found)]
+        # consecutive segments are joined in the chain
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        keep = b - a > 1
+        candidates.append(distinct(a[keep].astype(np.int64)*len(heads)
+                                   + b[keep]))
+    pairs = distinct(np.hstack(candidates))
+    del candidates
+    a = pairs//len(heads)
+    b = pairs % len(heads)
+    if ignore is not None and len(ignore):
+        key = (a % size)*size + b % size
+        at = np.minimum(np.searchsorted(ignore, key), len(ignore) - 1)
+        keep = ignore[at] != key
+        a, b = a[keep], b[keep]
+
+    dist = segment_distances(heads[a], tails[a], heads[b], tails[b])
+    clash = dist < 1
+    return a[clash], b[clash], dist[clash]
+
+
+def spring_armatures(objects):
+    """Central armatures of the springs among the objects (or their
+    parents)"""
+    found = []
+    for ob in objects:
+        for arm in (ob, ob.parent):
+            if (arm is not None and arm.type == 'ARMATURE'
+                    and arm not in found
+                    and ('wire_diameter' in arm
+                         or arm.name.startswith("Spring armature"))):
+                found.append(arm)
+    return found
+
+
+def coil_bones(armature):
+    """First and last bone indices of the coil (the IK chain)"""
+    for i, bone in enumerate(armature.pose.bones):
+        ik = bone.constraints.get("IK")
+        if ik is not None:
+            return i - ik.chain_count + 1, i
+    return 0, len(armature.pose.bones) - 1
+
+
+def check_spring_clashes(scene, armatures, frame_start, frame_end,
+                         d=0.002, samples=1000000):
+    """Samples the spring rigs over the frame range and looks for coil
+    clash (coil compressed past solid height) and hook overlap.
+
+    The bones of the central armature stand in for the wire: the clearance
+    between every pair of bones is checked against the wire diameter
+    stored in the rig (d is used for springs that do not have it). Pairs
+    already touching in the rest pose, like neighbour bones or the turns
+    of a closed hook, are part of the design and ignored.
+
+    This is an approximation. The hook bones lie on the wire centerline,
+    but the coil bones are chords of about 72 degrees built at radius
+    D/2+d (see generate_spring). Turns keep their spacing along the axis,
+    so coil clashes are found where the wire closes to solid, while
+    clearances between the coil and the hooks can be off by about d.
+
+    The frames are checked in blocks of about samples wire samples (see
+    wire_samples), so the memory used stays the same whatever the number
+    of springs and how far they are stretched.
+
+    Returns one entry per spring and frame with clashes: (armature name,
+    frame, kind, clearance, ranges, pairs) where kind is "coil", "hook" or
+    "coil and hook", clearance is the smallest (negative) one in scene
+    units, ranges are the (first, last) bones of every run of consecutive
+    clashing bones and pairs the clashing bone pairs (a, b)."""
+    bones = np.array([len(arm.pose.bones) for arm in armatures])
+    wire = np.array([arm.get('wire_diameter', d) for arm in armatures])
+    size = np.sum(bones)
+    first = np.cumsum(bones) - bones
+    spring = np.repeat(np.arange(len(armatures)), bones)
+    local = np.arange(size) - first[spring]
+    coil = np.array([coil_bones(arm) for arm in armatures])
+    in_coil = (local >= coil[spring, 0]) & (local <= coil[spring, 1])
+
+    # bone pairs in contact by design
+    heads = np.empty((size, 3), dtype=np.float32)
+    tails = np.empty((size, 3), dtype=np.float32)
+    for arm, start, stop in zip(armatures, first, first + bones):
+        arm.data.bones.foreach_get('head_local', heads[start:stop].ravel())
+        arm.data.bones.foreach_get('tail_local', tails[start:stop].ravel())
+    a, b, _ = wire_clashes(heads, tails, spring, wire[spring])
+    rest = np.sort(a*size + b)
+
+    clashes = []
+    block = []
+    block_samples = 0
+    current = scene.frame_current
+    try:
+        for frame in range(frame_start, frame_end + 1):
+            scene.frame_set(frame)
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            heads = np.empty((size, 3), dtype=np.float32)
+            tails = np.empty((size, 3), dtype=np.float32)
+            scale = np.empty(len(armatures))
+            for j, (arm, start, stop) in enumerate(zip(armatures, first,
+                                                       first + bones)):
+                evaluated = arm.evaluated_get(depsgraph)
+                matrix = np.array(evaluated.matrix_world)
+                for ends, attr in ((heads, 'head'), (tails, 'tail')):
+                    evaluated.pose.bones.foreach_get(attr,
+                                                     ends[start:stop].ravel())
+                    ends[start:stop] = (ends[start:stop] @ matrix[:3, :3].T
+                                        + matrix[:3, 3])
+                scale[j] = np.cbrt(abs(np.linalg.det(matrix[:3, :3])))
+            diam = (scale*wire)[spring]
+            block.append((frame, heads, tails, diam))
+            block_samples += np.sum(wire_samples(heads, tails, diam))
+            if block_samples < samples and frame < frame_end:
+                continue
+
+            frames, heads, tails, diam = zip(*block)
+            count = len(frames)
+            diam = np.hstack(diam)
+            groups = (np.repeat(np.arange(count), size)*len(armatures)
+                      + np.tile(spring, count))
+            a, b, dist = wire_clashes(np.vstack(heads), np.vstack(tails),
+                                      groups, diam, rest, size)
+            gap = (dist - 1)*diam[a]
+            frame_of = a // size
+            a = a % size
+            b = b % size
+            clashes.append(clash_summary(spring[a]*count + frame_of,
+                                         local[a], local[b],
+                                         in_coil[a] & in_coil[b], gap,
+                                         count, frames, armatures))
+            block = []
+            block_samples = 0
+    finally:
+        scene.frame_set(current)
+    return sorted((clash for summary in clashes for clash in summary),
+                  key=lambda clash: (clash[0], clash[1]))
+
+
+def clash_summary(group, a, b, coil, gap, count, frames, armatures):
+    """One entry per spring and frame (group = spring*count + frame
+    index) from the clashing bone pairs, see check_spring_clashes"""
+    if not len(group):
+        return []
+    groups, index = np.unique(group, return_inverse=True)
+    clearance = np.full(len(groups), np.inf)
+    pairs = np.bincount(index, minlength=len(groups))
+    coil_pairs = np.bincount(index, weights=coil, minlength=len(groups))
+    np.minimum.at(clearance, index, gap)
+    kind = np.where(coil_pairs == pairs, "coil",
+                    np.where(coil_pairs == 0, "hook", "coil and hook"))
+
+    # the pairs of every entry in order
+    order = np.lexsort((b, a, index))
+    pair_lists = np.split(np.column_stack([a, b])[order],
+                          np.cumsum(pairs)[:-1])
+
+    # runs of consecutive bones among the ones in the pairs, the stride
+    # leaves a gap between the bones of different entries
+    stride = np.max(b) + 2
+    bones = np.unique(np.hstack([index*stride + a, index*stride + b]))
+    new = np.hstack([True, np.diff(bones) != 1])
+    first = bones[new]
+    last = bones[np.hstack([new[1:], True])]
+    runs = np.split(np.column_stack([first, last]) % stride,
+                    np.cumsum(np.bincount(first//stride,
+                                          minlength=len(groups)))[:-1])
+
+    return [(armatures[g//count].name, int(frames[g % count]), str(k),
+             float(c), tuple(map(tuple, r.tolist())),
+             tuple(map(tuple, p.tolist())))
+            for g, k, c, r, p in zip(groups, kind, clearance, runs,
+                                     pair_lists)]
+
+
+class OBJECT_OT_springs_clashes(bpy.types.Operator):
+    """Checks the animated springs for coil clash and hook overlap"""
+    bl_idname = "object.springs_clashes"
+    bl_label = "Check Spring Clashes"
+    bl_options = {'REGISTER', 'UNDO'}
 
-        name_l = round(self.H*1000+self.D2*1000+self.h*1000*2+3*self.d*1000, 3)
-        if name_l % 1 > 0.01:
-            print(name_l)
-            name += " x " + str(round(name_l, 1))
-        else:
-            name += " x " + str(int(name_l))
+    frame_start: bpy.props.IntProperty(
+        name="Start",
+        description="First frame to check",
+        default=1)
+    frame_end: bpy.props.IntProperty(
+        name="End",
+        description="Last frame to check",
+        default=250)
+    d: bpy.props.FloatProperty(
+        name="Wire Diam",
+        description="Wire diameter of springs that don't store it",
+        default=2)
+    selected: bpy.props.BoolProperty(
+        name="Selected only",
+        description="Check only the selected springs",
+        default=False)
 
-        self.D = self.D-self.d
-        self.D2 = self.D2+self.d
+    def invoke(self, context, event):
+        self.frame_start = context.scene.frame_start
+        self.frame_end = context.scene.frame_end
+        return context.window_manager.invoke_props_dialog(self)
 
-        collection = bpy.data.collections.new(name)
-        bpy.context.scene.collection.children.link(collection)
-        layer = context.view_layer.layer_collection.children[collection.name]
-        bpy.context.view_layer.active_layer_collection = layer
-
-        # Draw the spring central line
-        if context.mode != 'OBJECT':
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-        scene.cursor.location = (x[0], y[0], z[0])
-        bpy.ops.mesh.primitive_vert_add()
-        x, y, z = remove_doubles(x, y, z)
-        size = len(x) - 1
-
-        for i in range(size):
-            bpy.ops.mesh.extrude_vertices_move(
-                MESH_OT_extrude_verts_indiv={"mirror": False},
-                TRANSFORM_OT_translate={"value": (x[i+1]-x[i], y[i+1]-y[i],
-                                                  z[i+1]-z[i]),
-                                        "orient_type": 'LOCAL'})
-
-        # Create a mesh from spline bevel
-        bpy.ops.object.mode_set(mode="OBJECT")
-        bpy.ops.object.convert(target='CURVE')
-        spring = context.active_object
-        spring.name = 'Spring mesh'
-        geometry = spring.data.splines.id_data.name
-        bpy.data.curves[geometry].bevel_depth = self.d/2
-        bpy.data.curves[geometry].bevel_resolution = k
-        bpy.ops.object.convert(target='MESH')
-        bpy.ops.object.shade_smooth()
-
-        # #Add slots assign the material to the mesh
-        # materials = ["Chromium","Black oxide","Stainless steel","Zinc"]
-        # for i,mat in enumerate(materials):
-        #     bpy.ops.object.material_slot_add()
-        #     spring.data.materials[i] = bpy.data.materials[mat]
-        # spring.active_material_index = self.mat
-        # bpy.ops.object.mode_set(mode = "EDIT")
-        # bpy.ops.mesh.select_all(action="SELECT")
-        # bpy.ops.object.material_slot_assign()
-        # bpy.ops.mesh.select_all(action="DESELECT")
-        # bpy.ops.object.mode_set(mode = "OBJECT")
-
-        # Add edge loops for beter shading and close cap and tail.
-        context.tool_settings.mesh_select_mode = (True, False, False)
-        for i in np.arange(0, 10, 1):
-            spring.data.vertices[i].select = True
-        bpy.ops.object.mode_set(mode="EDIT")
-
-        if self.hook_type == 1:
-            bpy.ops.transform.resize(value=(1, 1, 0))
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                                "value": (0, 0, -0.2*self.D2)})
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                                "value": (0, 0, -0.1*self.d)})
-        elif self.hook_type == 2:
-            bpy.ops.transform.resize(value=(1, 1, 0))
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                                "value": (0, 0, 0.1*self.d)})
-        elif self.hook_type == 3:
-            v0 = context.active_object.data.polygons[0].normal
-            v1 = context.active_object.data.polygons[1].normal
-            normal = np.cross(v0, v1)
-            normal = normal/np.sqrt(np.sum(np.power(normal, 2)))
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                     "value": tuple(-0.1*L/(N+4*n+1)*normal)})
-        bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                                    "value": (0, 0, 0)})
-        bpy.ops.transform.resize(value=(0.7, 0.7, 0.7), orient_type="LOCAL")
-        bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                                        "value": (0, 0, 0)})
-        bpy.ops.mesh.merge(type='CENTER')
-
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.object.mode_set(mode="OBJECT")
-        size = len(list(spring.data.vertices))
-
-        if self.hook_type == 1:
-            for i in np.arange(size-41, size-31, 1):
-                spring.data.vertices[i].select = True
-            bpy.ops.object.mode_set(mode="EDIT")
-            bpy.ops.transform.resize(value=(1, 1, 0))
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                        "value": (0, 0, 0.2*self.D2), "orient_type": "LOCAL"})
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                            "value": (0, 0, 0.1*self.d)})
-        elif self.hook_type == 2:
-            for i in np.arange(size-31, size-21, 1):
-                spring.data.vertices[i].select = True
-            bpy.ops.object.mode_set(mode="EDIT")
-            bpy.ops.transform.resize(value=(1, 1, 0))
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                                "value": (0, 0, -0.1*self.d)})
-        elif self.hook_type == 3:
-            for i in np.arange(size-31, size-21, 1):
-                spring.data.vertices[i].select = True
-            bpy.ops.object.mode_set(mode="EDIT")
-            v0 = context.active_object.data.polygons[-31].normal
-            v1 = context.active_object.data.polygons[-32].normal
-            normal = np.cross(v0, v1)
-            normal = normal/np.sqrt(np.sum(np.power(normal, 2)))
-            bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                "value": tuple(-0.15*L/(N+4*n+1)*normal)})
-        bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                                    "value": (0, 0, 0)})
-        bpy.ops.transform.resize(value=(0.7, 0.7, 0.7), orient_type="LOCAL")
-        bpy.ops.mesh.extrude_edges_move(TRANSFORM_OT_translate={
-                                "value": (0, 0, 0), "orient_type": 'GLOBAL'})
-        bpy.ops.mesh.merge(type='CENTER')
-        bpy.ops.object.mode_set(mode="OBJECT")
-        spring.data.vertices[-1].select = False
-
-        if self.hook_type == 3:
-            bpy.ops.mesh.primitive_cube_add(size=(
-                                self.D+self.d)*1.1,
-                                enter_editmode=True, align='WORLD',
-                                location=(0, 0, -(1.1*(self.D+self.d)/2)))
-            bpy.ops.mesh.primitive_cube_add(
-                            size=(self.D+self.d)*1.1,
-                            enter_editmode=False, align='WORLD',
-                            location=(0, 0, (self.H+1.1*(self.D+self.d)/2)))
-            bpy.ops.object.mode_set(mode="OBJECT")
-            sustract = context.active_object
-            sustract.select_set(False)
-            context.view_layer.objects.active = spring
-            spring.select_set(True)
-            bpy.ops.object.modifier_add(type='BOOLEAN')
-            modifier = bpy.data.objects[spring.name].modifiers["Boolean"]
-            modifier.operation = 'DIFFERENCE'
-            modifier.object = sustract
-            bpy.ops.object.modifier_apply(apply_as='DATA',  modifier='Boolean')
-            bpy.data.objects[spring.name].select_set(False)
-            bpy.data.objects[sustract.name].select_set(True)
-            bpy.ops.object.delete(use_global=False)
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.remove_doubles(threshold=0.00001)
-        bpy.ops.object.mode_set(mode="OBJECT")
-        bpy.ops.object.origin_set(type="ORIGIN_GEOMETRY")
-        bpy.ops.object.transform_apply(location=True,
-                                       rotation=True, scale=True)
-
-        # Create central spring armature
-
-        u = np.linspace(self.H, 0, N/3)
-        if self.hook_type == 3:
-            z1 = np.linspace(self.H-0.3*self.d/2,  0+0.3*self.d/2,  N/3)
+    def execute(self, context):
+        scene = context.scene
+        if self.selected:
+            armatures = spring_armatures(context.selected_objects)
         else:
-            z1 = u
-        x1 = (self.D/2+self.d)*np.cos(2*np.pi*self.p*u)
-        y1 = (self.D/2+self.d)*np.sin(2*np.pi*self.p*u)
-
-        x_up_hook = np.hstack([x5[::3],  x4[::3]])
-        y_up_hook = np.hstack([y5[::3],  y4[::3]])
-        z_up_hook = np.hstack([z5[::3],  z4[::3]])
-        up_len = len(x_up_hook)
-
-        x_lo_hook = np.hstack([x2[::3],  x3[::3]])
-        y_lo_hook = np.hstack([y2[::3],  y3[::3]])
-        z_lo_hook = np.hstack([z2[::3],  z3[::3]])
-        lo_len = len(x_lo_hook)
-
-        x = np.hstack([x_up_hook, x1, x_lo_hook])
-        y = np.hstack([y_up_hook, y1, y_lo_hook])
-        z = np.hstack([z_up_hook, z1, z_lo_hook])
-        x, y, z = remove_doubles(x, y, z)
-
-        scene.cursor.location = (x[0], y[0], z[0])
-        bpy.ops.object.armature_add()
-        bpy.ops.object.mode_set(mode='EDIT')
-        scene.cursor.location = (x[1], y[1], z[1])
-        bpy.ops.view3d.snap_selected_to_cursor(use_offset=False)
-
-        size = len(x)
-        for i in range(size-2):
-            bpy.ops.armature.extrude_move(
-                ARMATURE_OT_extrude={"forked": False},
-                TRANSFORM_OT_translate={
-                    "value": (x[i+2]-x[i+1],
-                              y[i+2]-y[i+1], z[i+2]-z[i+1]),
-                    "orient_type": 'GLOBAL'})
-
-        bpy.ops.armature.select_all(action='SELECT')
-        bpy.ops.view3d.snap_cursor_to_selected()
-
-        spring_armature = context.active_object
-        spring_armature.name = "Spring armature"
-        roll = bpy.data.objects[spring_armature.name].data.edit_bones[
-                                                        size-lo_len-1].roll
-        for i in [up_len-1, size-lo_len-1]:
-            bpy.data.objects[
-                spring_armature.name].data.edit_bones[i].select = False
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.origin_set(type="ORIGIN_CURSOR")
-        self.__spring_bones = size-1
-        bpy.ops.object.transform_apply(location=True,
-                                       rotation=True, scale=True)
-
-        # Mark the two middle bones with digital signature just for fun :-)
-        spring_armature.data.bones[8].name = 'Elbio Peña'
-        if size-2 >= 17:
-            position = 17
+            armatures = spring_armatures(scene.objects)
+        if not armatures:
+            self.report({'INFO'}, "No springs found")
+            return {'CANCELLED'}
+
+        clashes = check_spring_clashes(scene, armatures, self.frame_start,
+                                       self.frame_end, self.d/1000)
+        for name, frame, kind, gap, ranges, pairs in clashes:
+            bones = ", ".join(f"{a}-{b}" if b > a else f"{a}"
+                              for a, b in ranges)
+            print(f"{name}: frame {frame}, {kind} clash at bones {bones} "
+                  f"({len(pairs)} bone pairs, {gap*1000:.3f} mm)")
+        if clashes:
+            frames = len({clash[1] for clash in clashes})
+            self.report({'WARNING'}, f"Clashes in {len(clashes)} spring "
+                                     f"frames ({frames} frames), see the "
+                                     f"console")
         else:
-            position = 7
-        spring_armature.pose.bones[position].name = "Elbio Peña"
-
-        # add empties
-        bpy.ops.object.mode_set(mode="OBJECT")
-
-        if self.hook_type == 1:
-            up_location = (0, 0, self.H + self.D2/2 + self.h + self.d)
-            lo_location = (0, 0, -self.D2/2-self.h-self.d)
-        elif self.hook_type == 2:
-            up_location = (0, 0, self.H + self.D2/2)
-            lo_location = (0, 0, -self.D2/2)
-        elif self.hook_type == 3:
-            up_location = (0, 0, self.H)
-            lo_location = (0, 0, 0)
-
-        scene.cursor.location = up_location
-        bpy.ops.object.empty_add(type='PLAIN_AXES')
-        up_driver = context.active_object
-        up_driver.empty_display_size = 0.55*self.D
-        up_driver.name = "Upper driver"
-
-        scene.cursor.location = lo_location
-        bpy.ops.object.empty_add(type='PLAIN_AXES')
-        lo_driver = context.active_object
-        lo_driver.empty_display_size = 0.55*self.D
-        lo_driver.name = "Lower driver"
-
-        # Add control armatures and parent to empties
-        scene.cursor.location = up_location
-        bpy.ops.object.armature_add(radius=self.D/25)
-        up_armature = context.active_object
-        up_armature.name = "Upper armature"
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.ops.transform.rotate(value=np.pi, orient_axis='Y')
-        coord_1 = np.array([x[up_len-1],  y[up_len-1],  z[up_len-1]])
-        coord_2 = np.array([x[up_len-2],  y[up_len-2],  z[up_len-2]])
-        vec = coord_1 - coord_2
-        coord_3 = coord_2 + vec/100
-        scene.cursor.location = coord_2
-        bpy.ops.armature.bone_primitive_add()
-        scene.cursor.location = coord_3
-        bpy.ops.view3d.snap_selected_to_cursor(use_offset=False)
-        bpy.ops.object.mode_set(mode="OBJECT")
-        up_anchor = up_armature.data.bones[1]
-        up_anchor.name = 'Upper anchor'
-        up_guide = up_armature.data.bones[0]
-        up_guide.name = 'Upper guide'
-        up_anchor.select = True
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.ops.armature.parent_set(type='OFFSET')
-        bpy.ops.object.mode_set(mode="OBJECT")
-        context.view_layer.objects.active = up_driver
-        bpy.ops.object.parent_set(type='OBJECT', keep_transform=False)
-
-        scene.cursor.location = lo_location
-        bpy.ops.object.armature_add(radius=self.D/25)
-        bpy.ops.object.mode_set(mode="OBJECT")
-        lo_armature = context.active_object
-        lo_armature.name = "Lower armature"
-        bpy.ops.object.mode_set(mode="EDIT")
-        coord_1 = np.array([x[size-lo_len-1], y[size-lo_len-1],
-                            z[size-lo_len-1]])
-        coord_2 = np.array([x[size-lo_len], y[size-lo_len],
-                            z[size-lo_len]])
-        vec = coord_2 - coord_1
-        coord_3 = coord_2 + vec/100
-        scene.cursor.location = coord_2
-        bpy.ops.armature.bone_primitive_add()
-        scene.cursor.location = coord_3
-        bpy.ops.view3d.snap_selected_to_cursor(use_offset=False)
-        bpy.ops.object.parent_set(type='OBJECT', keep_transform=False)
-        bpy.ops.object.mode_set(mode="OBJECT")
-        lo_anchor = lo_armature.data.bones[1]
-        lo_anchor.name = 'Lower anchor'
-        lo_guide = lo_armature.data.bones[0]
-        lo_guide.name = 'Lower guide'
-        lo_anchor.select = True
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.ops.armature.parent_set(type='OFFSET')
-        bpy.ops.object.mode_set(mode="OBJECT")
-        context.view_layer.objects.active = lo_driver
-        bpy.ops.object.parent_set(type='OBJECT', keep_transform=False)
-        context.view_layer.objects.active = lo_armature
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.data.objects[lo_armature.name].data.edit_bones[1].roll = roll
-        bpy.ops.object.mode_set(mode="OBJECT")
-
-        # Add damped track constraints upper and lower guides
-        context.view_layer.objects.active = up_armature
-        up_armature.data.bones.active = up_armature.data.bones[0]
-        bpy.ops.object.mode_set(mode="POSE")
-        bpy.ops.pose.constraint_add(type='DAMPED_TRACK')
-        bone_constraint = up_armature.pose.bones[0].constraints['Damped Track']
-        bone_constraint.target = lo_driver
-        bone_constraint.track_axis = 'TRACK_Y'
-        bone_constraint.influence = 1.0
-        bpy.ops.object.mode_set(mode="OBJECT")
+            self.report({'INFO'}, "No clashes")
+        return {'FINISHED'}
 
-        context.view_layer.objects.active = lo_armature
-        lo_armature.data.bones.active = lo_armature.data.bones[0]
-        bpy.ops.object.mode_set(mode="POSE")
-        bpy.ops.pose.constraint_add(type='DAMPED_TRACK')
 
-        bone_constraint = lo_armature.pose.bones[0].constraints['Damped Track']
-        bone_constraint.target = up_driver
-        bone_constraint.track_axis = 'TRACK_Y'
-        bone_constraint.influence = 1.0
-        bpy.ops.object.mode_set(mode="OBJECT")
-        lo_armature.select_set(False)
-
-        # add iverse kinematics to spring armature last bone
-        context.view_layer.objects.active = spring_armature
-        ik_bone = spring_armature.data.bones[size-lo_len-1]
-        spring_armature.data.bones.active = ik_bone
-        bpy.ops.object.mode_set(mode='POSE')
-        bpy.ops.pose.select_all(action='DESELECT')
-        bpy.ops.pose.constraint_add(type="IK")
-        bpy.ops.object.mode_set(mode="OBJECT")
-        ik_bone = spring_armature.pose.bones[size-lo_len-1]
-        ik_bone.constraints["IK"].target = lo_armature
-        lo_anchor = lo_armature.data.bones[1]
-        ik_bone.constraints["IK"].subtarget = lo_anchor.name
-        ik_bone.constraints["IK"].chain_count = size-lo_len-up_len
-        ik_bone.constraints["IK"].use_tail = True
-        ik_bone.constraints["IK"].use_stretch = True
-        ik_bone.constraints["IK"].use_location = True
-        ik_bone.constraints["IK"].use_rotation = True
-        ik_bone.constraints["IK"].weight = 1.0
-        ik_bone.constraints["IK"].orient_weight = 1.0
-        ik_bone.constraints["IK"].influence = 1.0
-
-        # parent spring armature first bone to upper anchor
-        bpy.data.objects[lo_armature.name].select_set(False)
-        bpy.data.objects[spring_armature.name].select_set(True)
-        spring_armature.pose.bones[up_len].bone.select = True
-        up_armature.data.bones.active = up_armature.pose.bones[1].bone
-        up_armature.data.bones[0].select = False
-        up_armature.data.bones[1].select = True
-        context.view_layer.objects.active = up_armature
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.object.mode_set(mode='POSE')
-        bpy.ops.object.parent_set(type='BONE')
-        bpy.ops.object.mode_set(mode='OBJECT')
+# ########### PROFILING ##############
+
+RIG_COMPONENTS = ("IK", "Damped Track", "Copy Rotation", "Armature deform")
+
+
+def spring_rig(armature):
+    """Objects of the rig built around a central spring armature and the
+    switches (datablock, attribute) that disable each of its components"""
+    components = {name: [] for name in RIG_COMPONENTS}
+    objects = [armature]
+
+    _, last = coil_bones(armature)
+    ik = armature.pose.bones[last].constraints.get("IK")
+    if ik is not None:
+        components["IK"].append((ik, 'mute'))
+    for child in armature.children:
+        for modifier in child.modifiers:
+            if modifier.type == 'ARMATURE' and modifier.object == armature:
+                components["Armature deform"].append((modifier,
+                                                      'show_viewport'))
+                objects.append(child)
+
+    # control armatures and their drivers
+    controls = [armature.parent]
+    if ik is not None:
+        controls.append(ik.target)
+    for control in controls:
+        if control is None or control.type != 'ARMATURE':
+            continue
+        objects.append(control)
+        track = control.pose.bones[0].constraints.get("Damped Track")
+        if track is not None:
+            components["Damped Track"].append((track, 'mute'))
+        if control.parent is not None:
+            objects.append(control.parent)
+            copy = control.parent.constraints.get("Copy Rotation")
+            if copy is not None:
+                components["Copy Rotation"].append((copy, 'mute'))
+    return objects, components
+
+
+def evaluation_time(depsgraph, objects):
+    """Seconds the depsgraph takes to re-evaluate the objects"""
+    for ob in objects:
+        ob.update_tag(refresh={'OBJECT', 'DATA'})
+    start = perf_counter()
+    depsgraph.update()
+    return perf_counter() - start
+
+
+def profile_springs(scene, armatures, frame_start, frame_end, step=1):
+    """Steps the frame range and measures the evaluation time of every
+    spring rig and of each of its components.
+
+    At every frame the whole rig is re-evaluated alone, then once more
+    with each component disabled; the difference is the component cost.
+    Works headless, e.g. blender -b scene.blend --python-expr ...
+
+    Returns a list of (armature name, total, {component: time}) with the
+    mean seconds per frame, slowest spring first."""
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    rigs = [spring_rig(arm) for arm in armatures]
+    times = np.zeros((len(rigs), len(RIG_COMPONENTS) + 1))
+    frames = range(frame_start, frame_end + 1, step)
+
+    # the rigs are changed while profiling, whatever happens they are left
+    # as they were
+    current = scene.frame_current
+    state = [(data, attr, getattr(data, attr)) for _, components in rigs
+             for switches in components.values() for data, attr in switches]
+    try:
+        for frame in frames:
+            scene.frame_set(frame)
+            for i, (objects, components) in enumerate(rigs):
+                total = evaluation_time(depsgraph, objects)
+                times[i, 0] += total
+                for j, name in enumerate(RIG_COMPONENTS):
+                    switches = components[name]
+                    if not switches:
+                        continue
+                    values = [getattr(data, attr) for data, attr in switches]
+                    for data, attr in switches:
+                        setattr(data, attr, attr == 'mute')
+                    # switching may rebuild the relations, keep it out of
+                    # the measure
+                    depsgraph.update()
+                    times[i, j+1] += total - evaluation_time(depsgraph,
+                                                             objects)
+                    for (data, attr), value in zip(switches, values):
+                        setattr(data, attr, value)
+                    depsgraph.update()
+    finally:
+        for data, attr, value in state:
+            setattr(data, attr, value)
+        scene.frame_set(current)
+
+    times = np.maximum(times/max(len(frames), 1), 0)
+    report = []
+    for i in np.argsort(-times[:, 0]):
+        report.append((armatures[i].name, times[i, 0],
+                       dict(zip(RIG_COMPONENTS, times[i, 1:]))))
+    return report
+
+
+class OBJECT_OT_springs_profile(bpy.types.Operator):
+    """Measures the evaluation time of the spring rigs per frame"""
+    bl_idname = "object.springs_profile"
+    bl_label = "Profile Springs"
+    bl_options = {'REGISTER', 'UNDO'}
 
-        #  parent spring mesh to spring armature and set final settings
-        bpy.data.objects[spring.name].select_set(True)
-        context.view_layer.objects.active = spring_armature
-        bpy.ops.object.parent_set(type='ARMATURE_AUTO')
-
-        context.view_layer.objects.active = lo_driver
-        bpy.ops.object.constraint_add(type='COPY_ROTATION')
-        lo_driver.constraints['Copy Rotation'].target = up_driver
-        bpy.data.objects[spring.name].hide_select = False
-        spring_armature.hide_render = True
-        up_armature.hide_render = True
-        lo_armature.hide_render = True
-        spring_armature.display_type = "BOUNDS"
-        context.view_layer.objects.active = spring
-
-        up_driver.select_set(True)
-        up_armature.select_set(True)
-        lo_driver.select_set(True)
-        lo_armature.select_set(True)
-
-        # move everything to the original curso location
-        context.view_layer.objects.active = lo_driver
-        scene.tool_settings.transform_pivot_point = 'ACTIVE_ELEMENT'
-        scene.cursor.location = lo_location
-        bpy.ops.object.origin_set(type="ORIGIN_CURSOR")
-        bpy.ops.transform.translate(value=cursor_loc, orient_type='GLOBAL')
-        scene.cursor.location = cursor_loc
-
-        # Restore original settings
-        if self.hook_angle == 2:
-            self.p = self.p - 0.25/self.H
-        scale_length = scene.unit_settings.scale_length
-        unit_length = scene.unit_settings.length_unit
-        cursor_loc = list(scene.cursor.location)
-
-        self.D = self.D*1000
-        self.d = self.d*1000
-        self.D2 = self.D2*1000
-        self.H = self.H*1000
-        self.h = self.h*1000
-
-        scene.tool_settings.transform_pivot_point = pivot_point
-        scene.transform_orientation_slots[0].type = orientation
-        scene.tool_settings.use_mesh_automerge = auto_merge
-        scene.unit_settings.system = unit_system
-        scene.unit_settings.scale_length = scale_length
-        scene.unit_settings.length_unit = unit_length
-        scene.cursor.location = cursor_loc
+    frame_start: bpy.props.IntProperty(
+        name="Start",
+        description="First frame to profile",
+        default=1)
+    frame_end: bpy.props.IntProperty(
+        name="End",
+        description="Last frame to profile",
+        default=250)
+    step: bpy.props.IntProperty(
+        name="Step",
+        description="Profile every n frames",
+        default=1, min=1)
+    selected: bpy.props.BoolProperty(
+        name="Selected only",
+        description="Profile only the selected springs",
+        default=False)
+
+    def invoke(self, context, event):
+        self.frame_start = context.scene.frame_start
+        self.frame_end = context.scene.frame_end
+        return context.window_manager.invoke_props_dialog(self)
 
+    def execute(self, context):
+        scene = context.scene
+        if self.selected:
+            armatures = spring_armatures(context.selected_objects)
+        else:
+            armatures = spring_armatures(scene.objects)
+        if not armatures:
+            self.report({'INFO'}, "No springs found")
+            return {'CANCELLED'}
+
+        report = profile_springs(scene, armatures, self.frame_start,
+                                 self.frame_end, self.step)
+        lines = [f"{'Spring':<30}{'Total':>10}"
+                 + "".join(f"{name:>18}" for name in RIG_COMPONENTS)]
+        for spring, total, components in report:
+            lines.append(f"{spring:<30}{total*1000:>10.3f}"
+                         + "".join(f"{components[name]*1000:>18.3f}"
+                                   for name in RIG_COMPONENTS))
+        lines.append("(ms per frame)")
+
+        text = bpy.data.texts.get("Springs profile")
+        if text is None:
+            text = bpy.data.texts.new("Springs profile")
+        text.from_string("\n".join(lines))
+        print(text.as_string())
+        self.report({'INFO'}, "Profile written to the 'Springs profile' "
+                              "text")
+        return {'FINISHED'}
+
+
+class OBJECT_OT_springs_properties(bpy.types.Operator):
+    """Computes the engineering properties of all the springs in the file"""
+    bl_idname = "object.springs_properties"
+    bl_label = "Spring Properties"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    mat: bpy.props.IntProperty(
+        name="material",
+        description="Material of springs that don't store their parameters"
+                    "\n0-Chomium\n1-Black oxide\n2-Stainless steel\n3-Zinc",
+        default=0, min=0, max=3)
+
+    def execute(self, context):
+        # springs made before the parameters were stored are measured
+        armatures = []
+        parameters = []
+        for arm in spring_armatures(bpy.data.objects):
+            if 'spring_parameters' in arm:
+                row = list(arm['spring_parameters'])
+            else:
+                row = rig_parameters(arm, self.mat)
+            if row is not None:
+                armatures.append(arm)
+                parameters.append(row)
+        if not armatures:
+            self.report({'INFO'}, "No springs found")
+            return {'CANCELLED'}
+
+        table = spring_properties(parameters)
+        for arm, row in zip(armatures, table):
+            for child in arm.children:
+                if child.type == 'MESH':
+                    set_spring_properties(child, row)
+        self.report({'INFO'}, f"Updated {len(armatures)} springs")
         return {'FINISHED'}
 
 
@@ -736,14 +1455,23 @@ class VIEW3D_PT_springs_panel(bpy.types.Panel):
 
     def draw(self, context):
         self.layout.operator('mesh.add_springs')
+        self.layout.operator('object.springs_clashes')
+        self.layout.operator('object.springs_profile')
+        self.layout.operator('object.springs_properties')
 
 
 def register():
     bpy.utils.register_class(MESH_OT_springs)
+    bpy.utils.register_class(OBJECT_OT_springs_clashes)
+    bpy.utils.register_class(OBJECT_OT_springs_profile)
+    bpy.utils.register_class(OBJECT_OT_springs_properties)
     bpy.utils.register_class(VIEW3D_PT_springs_panel)
     print("oh yeah")
 
 
 def unregister():
     bpy.utils.unregister_class(MESH_OT_springs)
+    bpy.utils.unregister_class(OBJECT_OT_springs_clashes)
+    bpy.utils.unregister_class(OBJECT_OT_springs_profile)
+    bpy.utils.unregister_class(OBJECT_OT_springs_properties)
     bpy.utils.unregister_class(VIEW3D_PT_springs_panel)